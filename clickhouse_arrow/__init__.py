@@ -13,8 +13,10 @@
 # limitations under the License.
 
 import collections.abc
-from typing import Any, Iterator
-from urllib.parse import urlencode
+import functools
+import io
+from typing import Any, Callable, Iterable, Iterator
+from urllib.parse import quote_from_bytes, urlencode
 
 import pyarrow as pa
 import urllib3
@@ -22,6 +24,30 @@ from importlib.metadata import version
 
 __version__ = version(__package__)
 
+# The size of the reads from the response when reading an ArrowStream, pyarrow
+# otherwise issues a separate (small) read for each part of an IPC message.
+STREAM_BUFFER_SIZE = 256 * 1024
+
+# The response encodings that urllib3 can decode (gzip and deflate, and br
+# when brotli is installed).
+ACCEPT_ENCODING = urllib3.util.request.ACCEPT_ENCODING
+
+# The size of the query parameters above which they are sent in the body of the
+# request (as a form) rather than in the URL. Servers (and proxies) limit the
+# size of the URL.
+MAX_URL_PARAMS_SIZE = 16 * 1024
+
+# The maximum number of items in the tuple and list parameters that are cached
+# once bound (larger parameters are bound for every query).
+MAX_CACHED_PARAM_LENGTH = 64
+
+# The boundary of multipart/form-data bodies (a random value like urllib3's).
+MULTIPART_BOUNDARY = urllib3.filepost.choose_boundary().encode()
+
+# The settings that enable compression of responses (as negotiated by the
+# Accept-Encoding header).
+HTTP_COMPRESSION_SETTINGS = {"enable_http_compression": 1}
+
 
 class Client:
     """
@@ -31,8 +57,15 @@ class Client:
        url: (str) The host name of the server to connect to, defaults to `http://localhost:8123/`.
        user: (str) The optional username to authenticate with, defaults to `default`.
        password: (str) The optional password to authenticate with, defaults to empty.
-       pool: (PoolManager) The optional HTTP connection pool to use.
+       pool: (PoolManager) The optional HTTP connection pool to use. Clients used from
+          many threads (or many clients) should share a single pool.
        default_settings: (dict) The optional default settings to include with every query.
+       pool_maxsize: (int) The number of connections to keep alive per host when a pool
+          is not specified, defaults to 32.
+       http_compression: (bool) Whether to ask the server to compress responses (using
+          an encoding supported by urllib3), defaults to `False`.
+       insert_compression: (str) The optional codec (`lz4` or `zstd`) with which to
+          compress the buffers of inserted data, defaults to none.
     """
 
     def __init__(
@@ -42,14 +75,33 @@ class Client:
         password: str = "",
         pool: urllib3.PoolManager = None,
         default_settings: dict[str, Any] = None,
+        *,
+        pool_maxsize: int = 32,
+        http_compression: bool = False,
+        insert_compression: str = None,
     ):
         self._url = url
-        self._headers = {
+        self._insert_options = pa.ipc.IpcWriteOptions(compression=insert_compression)
+        headers = {
             "X-ClickHouse-User": user,
             "X-ClickHouse-Key": password,
         }
-        self._pool = pool or urllib3.PoolManager()
+        self._query_headers = headers | {
+            "Content-Type": "text/plain; charset=utf-8",
+        }
+        self._insert_headers = headers | {
+            "Content-Type": "application/octet-stream",
+        }
+        self._pool = pool or urllib3.PoolManager(maxsize=pool_maxsize, block=False)
         self._default_settings = default_settings
+        if http_compression:
+            self._query_headers["Accept-Encoding"] = ACCEPT_ENCODING
+            self._default_settings = combine_settings(
+                HTTP_COMPRESSION_SETTINGS, default_settings
+            )
+        self._default_query = (
+            urlencode(self._default_settings) if self._default_settings else None
+        )
 
     def execute(
         self,
@@ -94,13 +146,18 @@ class Client:
             ClickhouseException: When a non-success response status was received.
         """
         response = self._execute(query, params, settings, format_="ArrowStream")
-        return pa.ipc.open_stream(response)
+        source = io.BufferedReader(
+            ResponseReader(response),
+            buffer_size=STREAM_BUFFER_SIZE,
+        )
+        return pa.ipc.open_stream(source)
 
     def read_table(
         self,
         query: str,
         params: dict[str, Any] = None,
         settings: dict[str, Any] = None,
+        combine: bool = False,
     ) -> pa.Table:
         """
         Execute a query and read the result using the Arrow format
@@ -110,6 +167,9 @@ class Client:
             query: (str) The query to execute.
             params: (dict) The optional named query parameters (bound server-side).
             settings: (dict) The optional request settings.
+            combine: (bool) Whether to combine the batches into contiguous arrays,
+                defaults to `False`. This copies the result once but can speed up
+                later compute over the table.
 
         Returns:
             A `pyarrow.Table` instance containing the results.
@@ -117,8 +177,9 @@ class Client:
         Raises:
             ClickhouseException: When a non-success response status was received.
         """
-        batches = self.read_batches(query, params, settings)
-        return pa.Table.from_batches(batches)
+        with self.open_stream(query, params, settings) as reader:
+            table = reader.read_all()
+        return table.combine_chunks() if combine else table
 
     def read_batches(
         self,
@@ -143,15 +204,42 @@ class Client:
             ClickhouseException: When a non-success response status was received.
         """
         with self.open_stream(query, params, settings) as reader:
-            try:
-                while True:
-                    yield reader.read_next_batch()
-            except StopIteration:
-                pass
+            yield from reader
+
+    def read_ipc_stream(
+        self,
+        query: str,
+        params: dict[str, Any] = None,
+        settings: dict[str, Any] = None,
+    ) -> Iterator[bytes]:
+        """
+        Execute a query and read the raw result using the ArrowStream format
+        (without decoding it).
+
+        This is useful when passing the result to another consumer of Arrow IPC
+        streams (such as DuckDB or Polars).
+
+        Args:
+            query: (str) The query to execute.
+            params: (dict) The optional named query parameters (bound server-side).
+            settings: (dict) The optional request settings.
+
+        Returns:
+            An iterator of byte-strings containing the Arrow IPC stream.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        response = self._execute(query, params, settings, format_="ArrowStream")
+        # Decoded explicitly as urllib3 does not decode chunked responses by default.
+        yield from response.stream(STREAM_BUFFER_SIZE, decode_content=True)
 
     def insert(self, table: str, data: pa.Table):
         """
-        Inserts data into a table using the Arrow format.
+        Inserts data into a table using the ArrowStream format.
+
+        The buffers of `data` are sent as they are (without being copied
+        into a serialized request body), unless `insert_compression` is set.
 
         Column names must match between `table` and `data`.
 
@@ -162,11 +250,70 @@ class Client:
         Raises:
             ClickhouseException: When a non-success response status was received.
         """
-        columns = ", ".join(f"`{c}`" for c in data.column_names)
-        query = f"INSERT INTO {table} ({columns}) FORMAT Arrow"
-        url = append_url(self._url, query=query)
-        headers = self._headers | {"Content-Type": "application/octet-stream"}
-        body = serialize_ipc(data)
+        url = create_insert_url(self._url, table, tuple(data.column_names))
+        self._insert(url, data)
+
+    def insert_batches(
+        self,
+        table: str,
+        schema: pa.Schema,
+        batches: Iterable[pa.RecordBatch],
+    ):
+        """
+        Inserts an iterable of record batches into a table using the ArrowStream format.
+
+        Each batch is serialized and sent (using chunked transfer encoding) as it
+        is produced, so the whole of the data is never held in memory.
+
+        Column names must match between `table` and `schema`.
+
+        Args:
+            table: (str) The table into which to insert data.
+            schema: (pyarrow.Schema) The schema of the batches.
+            batches: (Iterable[pyarrow.RecordBatch]) The batches of data.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        url = create_insert_url(self._url, table, tuple(schema.names))
+        response = self._pool.urlopen(
+            "POST",
+            url,
+            headers=self._insert_headers,
+            body=serialize_ipc_stream(schema, batches, self._insert_options),
+            chunked=True,
+            # The body is a generator and so cannot be sent again.
+            retries=False,
+        )
+        ensure_success_status(response)
+
+    def prepare_insert(
+        self,
+        table: str,
+        schema: pa.Schema,
+    ) -> Callable[[pa.Table], None]:
+        """
+        Prepares repeated inserts of data with the same schema into a table.
+
+        The insert query is built once rather than for every call.
+
+        Args:
+            table: (str) The table into which to insert data.
+            schema: (pyarrow.Schema) The schema of the data that will be inserted.
+
+        Returns:
+            A callable that inserts a `pyarrow.Table` (with `schema`) into `table`
+            and raises `ClickhouseException` when a non-success response status
+            was received.
+        """
+        url = create_insert_url(self._url, table, tuple(schema.names))
+        return functools.partial(self._insert, url)
+
+    def _insert(self, url: str, data: pa.Table):
+        body = serialize_ipc_buffers(data, self._insert_options)
+        headers = self._insert_headers | {
+            "Content-Length": str(sum(len(b) for b in body)),
+        }
         response = self._pool.urlopen(
             "POST",
             url,
@@ -184,11 +331,17 @@ class Client:
     ):
         if format_:
             query += f" FORMAT {format_}"
-        fields = create_post_body(query, params)
-        body, content_type = urllib3.encode_multipart_formdata(fields)
-        headers = self._headers | {"Content-Type": content_type}
-        settings = self._combine_settings(settings)
-        url = append_url(self._url, **settings) if settings else self._url
+        url, body, content_type = create_query_request(
+            self._url,
+            query,
+            params,
+            settings,
+            self._default_settings,
+            self._default_query,
+        )
+        headers = self._query_headers
+        if content_type:
+            headers = headers | {"Content-Type": content_type}
         response = self._pool.urlopen(
             "POST",
             url,
@@ -199,17 +352,29 @@ class Client:
         ensure_success_status(response)
         return response
 
-    def _combine_settings(
-        self, settings: dict[str, Any] | None
-    ) -> dict[str, Any] | None:
-        match (settings, self._default_settings):
-            case (None, _):
-                return self._default_settings
-            case (_, None):
-                return settings
-            case (_, _):
-                return self._default_settings | settings
-        return None
+
+class ResponseReader(io.RawIOBase):
+    """
+    A raw reader of a response.
+
+    When decoding a compressed response, urllib3 may return more (or less) than
+    the requested number of bytes, so any excess is kept for the next read.
+    """
+
+    def __init__(self, response: urllib3.HTTPResponse):
+        self._response = response
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and not self._response.closed:
+            self._pending = self._response.read(len(buffer))
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = memoryview(self._pending)[:size]
+        self._pending = self._pending[size:]
+        return size
 
 
 class ClickhouseException(Exception):
@@ -227,47 +392,249 @@ class ClickhouseException(Exception):
         self.body = body
 
 
-def append_url(url: str, **query) -> str:
-    return f"{url}?{urlencode(query)}"
+@functools.lru_cache(maxsize=256)
+def create_insert_url(url: str, table: str, columns: tuple[str, ...]) -> str:
+    column_list = ", ".join([f"`{c}`" for c in columns])
+    query = f"INSERT INTO {table} ({column_list}) FORMAT ArrowStream"
+    return f"{url}?{encode_query(query)}"
+
+
+def encode_query(query: str) -> str:
+    # A faster equivalent of `urlencode({"query": query})`.
+    return "query=" + quote_from_bytes(query.encode("utf-8"), safe=b"")
+
+
+def create_query_request(
+    url: str,
+    query: str,
+    params: dict[str, Any] | None,
+    settings: dict[str, Any] | None,
+    default_settings: dict[str, Any] | None = None,
+    default_query: str | None = None,
+) -> tuple[str, bytes, str | None]:
+    # Returns the URL, body and content type (or `None` for the default plain text)
+    # of a query. The query is sent as the body (with the parameters in the URL)
+    # unless the parameters are too large for a URL, then it is sent as a form.
+    query_params = create_query_params(params)
+    if sum(len(v) for v in query_params.values()) > MAX_URL_PARAMS_SIZE:
+        body, content_type = encode_multipart({"query": query} | query_params)
+        query_params = {}
+    else:
+        body, content_type = query.encode("utf-8"), None
+    url = create_query_url(
+        url,
+        query_params,
+        settings,
+        default_settings,
+        default_query,
+    )
+    return url, body, content_type
+
+
+def create_query_url(
+    url: str,
+    query_params: dict[str, str],
+    settings: dict[str, Any] | None,
+    default_settings: dict[str, Any] | None = None,
+    default_query: str | None = None,
+) -> str:
+    # `default_query` is `default_settings` encoded up-front, so the default
+    # settings are only encoded per request when they are overridden (as they
+    # must only be sent once).
+    if settings:
+        if default_settings and not settings.keys().isdisjoint(default_settings):
+            settings = default_settings | settings
+            default_query = None
+        query_params = query_params | settings
+    query = urlencode(query_params)
+    if default_query:
+        query = f"{default_query}&{query}" if query else default_query
+    return f"{url}?{query}" if query else url
+
+
+def encode_multipart(fields: dict[str, str]) -> tuple[bytes, str]:
+    # A faster equivalent of `urllib3.encode_multipart_formdata` for text fields.
+    parts = [
+        b'--%b\r\nContent-Disposition: form-data; name="%b"\r\n\r\n%b\r\n'
+        % (MULTIPART_BOUNDARY, name.encode("utf-8"), value.encode("utf-8"))
+        for name, value in fields.items()
+    ]
+    parts.append(b"--%b--\r\n" % MULTIPART_BOUNDARY)
+    content_type = f"multipart/form-data; boundary={MULTIPART_BOUNDARY.decode()}"
+    return b"".join(parts), content_type
+
+
+def combine_settings(
+    default_settings: dict[str, Any] | None,
+    settings: dict[str, Any] | None,
+) -> dict[str, Any] | None:
+    match (settings, default_settings):
+        case (None, _):
+            return default_settings
+        case (_, None):
+            return settings
+        case (_, _):
+            return default_settings | settings
+    return None
+
+
+def create_query_params(params: dict[str, Any] | None) -> dict[str, str]:
+    if not params:
+        return {}
+    return {f"param_{k}": bind_param(v) for k, v in params.items()}
 
 
-def create_post_body(query: str, params: dict[str, Any]):
-    body = {"query": query}
-    if params:
-        body.update({f"param_{k}": bind_param(v) for k, v in params.items()})
-    return body
+def bind_param(value: Any, quote_strings=False) -> str:
+    key = param_cache_key(value)
+    if key is None:
+        return bind_value(value, quote_strings)
+    return bind_cached(key, quote_strings)
+
+
+def param_cache_key(value: Any) -> tuple | None:
+    # Only short tuples and lists of scalars are cached (binding a scalar is cheaper
+    # than the lookup, and the key keeps the items alive). The key includes the
+    # types as 1 == True. Floats are not cached as 0.0 == -0.0.
+    value_type = type(value)
+    if value_type is not tuple and value_type is not list:
+        return None
+    if len(value) > MAX_CACHED_PARAM_LENGTH:
+        return None
+    items = tuple(value)
+    item_types = tuple(map(type, items))
+    if CACHEABLE_TYPES.issuperset(item_types):
+        return value_type, items, item_types
+    return None
 
 
-def bind_param(value: Any, quote_strings=False) -> str:
+@functools.lru_cache(maxsize=1024)
+def bind_cached(key: tuple, quote_strings: bool) -> str:
+    value_type, items, _ = key
+    return PARAM_BINDERS[value_type](items, quote_strings)
+
+
+def bind_value(value: Any, quote_strings=False) -> str:
     # Inspired by clickhouse-connect.
-    if value is None:
-        return "NULL"
+    binder = PARAM_BINDERS.get(type(value), bind_other)
+    return binder(value, quote_strings)
+
+
+def bind_null(value: None, quote_strings: bool) -> str:
+    return "NULL"
+
+
+def bind_scalar(value: bool | int | float, quote_strings: bool) -> str:
+    return str(value)
+
+
+def bind_str(value: str, quote_strings: bool) -> str:
+    if quote_strings:
+        return f"'{value.translate(QUOTED_STRING_ESCAPES)}'"
+    return value
+
+
+def bind_tuple(value: tuple, quote_strings: bool) -> str:
+    return f"({', '.join([bind_value(v, True) for v in value])})"
+
+
+def bind_array(value: collections.abc.Iterable, quote_strings: bool) -> str:
+    return f"[{', '.join([bind_value(v, True) for v in value])}]"
+
+
+def bind_map(value: collections.abc.Mapping, quote_strings: bool) -> str:
+    pairs = [f"{bind_value(k, True)}:{bind_value(v, True)}" for k, v in value.items()]
+    return f"{{{', '.join(pairs)}}}"
+
+
+def bind_other(value: Any, quote_strings: bool) -> str:
+    # Handles subclasses of the types in `PARAM_BINDERS` (and any other iterable).
     if isinstance(value, (bool, int, float)):
-        return str(value)
+        return bind_scalar(value, quote_strings)
     if isinstance(value, str):
-        return f"'{value}'" if quote_strings else value
+        return bind_str(value, quote_strings)
     if isinstance(value, tuple):
-        return f"({', '.join([bind_param(v, True) for v in value])})"
-    if isinstance(value, dict):
-        pairs = (
-            bind_param(k, True) + ":" + bind_param(v, True) for k, v in value.items()
-        )
-        return f"{{{', '.join(pairs)}}}"
+        return bind_tuple(value, quote_strings)
+    if isinstance(value, collections.abc.Mapping):
+        return bind_map(value, quote_strings)
     if isinstance(value, collections.abc.Iterable):
-        return f"[{', '.join([bind_param(v, True) for v in value])}]"
+        return bind_array(value, quote_strings)
     return str(value)
 
 
+PARAM_BINDERS = {
+    type(None): bind_null,
+    bool: bind_scalar,
+    int: bind_scalar,
+    float: bind_scalar,
+    str: bind_str,
+    tuple: bind_tuple,
+    list: bind_array,
+    dict: bind_map,
+}
+
+CACHEABLE_TYPES = frozenset([type(None), bool, int, str])
+
+QUOTED_STRING_ESCAPES = str.maketrans({"\\": "\\\\", "'": "\\'"})
+
+
 def ensure_success_status(response: urllib3.HTTPResponse):
     if response.status != 200:
         raise ClickhouseException(response.status, str(response.data))
 
 
-def serialize_ipc(table: pa.Table) -> bytes:
-    buffer = pa.BufferOutputStream()
-    with pa.RecordBatchFileWriter(buffer, table.schema) as writer:
-        writer.write(table)
-    return buffer.getvalue()
+def serialize_ipc_buffers(
+    table: pa.Table,
+    options: pa.ipc.IpcWriteOptions = None,
+) -> list[bytes | pa.Buffer]:
+    # The returned buffers reference the memory of `table` (other than the small
+    # IPC metadata), so the table is written without copying it (unless the
+    # buffers are compressed).
+    sink = BufferSink()
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getbuffers()
+
+
+def serialize_ipc_stream(
+    schema: pa.Schema,
+    batches: Iterable[pa.RecordBatch],
+    options: pa.ipc.IpcWriteOptions = None,
+) -> Iterator[bytes]:
+    # Yields the IPC stream one record batch at a time so that only a single
+    # serialized batch is held in memory while it is being sent.
+    sink = BufferSink()
+    with pa.ipc.new_stream(sink, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.getvalue()
+    yield sink.getvalue()
+
+
+class BufferSink:
+    """
+    A minimal file-like sink that accumulates the buffers written by pyarrow
+    until they are taken with `getbuffers` (or `getvalue`).
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._buffers = []
+
+    def write(self, data: bytes | pa.Buffer) -> int:
+        self._buffers.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def getbuffers(self) -> list[bytes | pa.Buffer]:
+        buffers = self._buffers
+        self._buffers = []
+        return buffers
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.getbuffers())
 
 
 __all__ = ["Client", "ClickhouseException"]
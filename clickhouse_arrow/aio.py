@@ -0,0 +1,368 @@
+# Copyright 2023 Martin Galpin <galpin@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextlib
+import io
+from typing import Any, AsyncIterator, Iterable
+from urllib.parse import urlencode
+
+import aiohttp
+import pyarrow as pa
+
+from clickhouse_arrow import (
+    HTTP_COMPRESSION_SETTINGS,
+    STREAM_BUFFER_SIZE,
+    ClickhouseException,
+    combine_settings,
+    create_insert_url,
+    create_query_request,
+    serialize_ipc_buffers,
+    serialize_ipc_stream,
+)
+
+
+class AsyncClient:
+    """
+    A minimal asyncio client that uses the ClickHouse HTTP API and Apache Arrow.
+
+    Requires the optional `aiohttp` dependency (`pip install clickhouse_arrow[async]`).
+
+    Arrow decoding runs on a worker thread (reading the response from the event
+    loop), so many queries can be in flight on a single thread.
+
+    Args:
+       url: (str) The host name of the server to connect to, defaults to `http://localhost:8123/`.
+       user: (str) The optional username to authenticate with, defaults to `default`.
+       password: (str) The optional password to authenticate with, defaults to empty.
+       session: (aiohttp.ClientSession) The optional HTTP session to use.
+       default_settings: (dict) The optional default settings to include with every query.
+       limit: (int) The maximum number of connections when a session is not specified,
+          defaults to 32.
+       http_compression: (bool) Whether to ask the server to compress responses (using
+          an encoding supported by aiohttp), defaults to `False`.
+       insert_compression: (str) The optional codec (`lz4` or `zstd`) with which to
+          compress the buffers of inserted data, defaults to none.
+    """
+
+    def __init__(
+        self,
+        url: str = "http://localhost:8123/",
+        user: str = "default",
+        password: str = "",
+        session: aiohttp.ClientSession = None,
+        default_settings: dict[str, Any] = None,
+        *,
+        limit: int = 32,
+        http_compression: bool = False,
+        insert_compression: str = None,
+    ):
+        self._url = url
+        self._insert_options = pa.ipc.IpcWriteOptions(compression=insert_compression)
+        headers = {
+            "X-ClickHouse-User": user,
+            "X-ClickHouse-Key": password,
+        }
+        self._query_headers = headers | {
+            "Content-Type": "text/plain; charset=utf-8",
+        }
+        self._insert_headers = headers | {
+            "Content-Type": "application/octet-stream",
+        }
+        self._session = session
+        self._owns_session = session is None
+        self._limit = limit
+        self._default_settings = default_settings
+        if http_compression:
+            # aiohttp sends Accept-Encoding (and decodes the response) by default.
+            self._default_settings = combine_settings(
+                HTTP_COMPRESSION_SETTINGS, default_settings
+            )
+        self._default_query = (
+            urlencode(self._default_settings) if self._default_settings else None
+        )
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the HTTP session (unless it was specified when creating the client).
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def execute(
+        self,
+        query: str,
+        params: dict[str, Any] = None,
+        settings: dict[str, Any] = None,
+    ) -> bytes:
+        """
+        Executes a raw query.
+
+        Args:
+            query: (str) The query to execute.
+            params: (dict) The optional named query parameters (bound server-side).
+            settings: (dict) The optional request settings.
+
+        Returns:
+            The raw response as a byte-string.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        async with self._execute(query, params, settings) as response:
+            return await response.read()
+
+    async def read_table(
+        self,
+        query: str,
+        params: dict[str, Any] = None,
+        settings: dict[str, Any] = None,
+        combine: bool = False,
+    ) -> pa.Table:
+        """
+        Execute a query and read the result using the ArrowStream format
+        as a table.
+
+        Args:
+            query: (str) The query to execute.
+            params: (dict) The optional named query parameters (bound server-side).
+            settings: (dict) The optional request settings.
+            combine: (bool) Whether to combine the batches into contiguous arrays,
+                defaults to `False`. This copies the result once but can speed up
+                later compute over the table.
+
+        Returns:
+            A `pyarrow.Table` instance containing the results.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        async with self._open_stream(query, params, settings) as reader:
+            table = await asyncio.to_thread(reader.read_all)
+        if combine:
+            return await asyncio.to_thread(table.combine_chunks)
+        return table
+
+    async def read_batches(
+        self,
+        query: str,
+        params: dict[str, Any] = None,
+        settings: dict[str, Any] = None,
+    ) -> AsyncIterator[pa.RecordBatch]:
+        """
+        Execute a query and read the result using the ArrowStream format
+        as an asynchronous iterator of record batches.
+
+        Args:
+            query: (str) The query to execute.
+            params: (dict) The optional named query parameters (bound server-side).
+            settings: (dict) The optional request settings.
+
+        Returns:
+            An asynchronous iterator of `pyarrow.RecordBatch` instances containing
+            the results.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        async with self._open_stream(query, params, settings) as reader:
+            batches = iter(reader)
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                yield batch
+
+    async def read_ipc_stream(
+        self,
+        query: str,
+        params: dict[str, Any] = None,
+        settings: dict[str, Any] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Execute a query and read the raw result using the ArrowStream format
+        (without decoding it).
+
+        This is useful when passing the result to another consumer of Arrow IPC
+        streams (such as DuckDB or Polars).
+
+        Args:
+            query: (str) The query to execute.
+            params: (dict) The optional named query parameters (bound server-side).
+            settings: (dict) The optional request settings.
+
+        Returns:
+            An asynchronous iterator of byte-strings containing the Arrow IPC stream.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        async with self._execute(query, params, settings, "ArrowStream") as response:
+            async for chunk in response.content.iter_chunked(STREAM_BUFFER_SIZE):
+                yield chunk
+
+    async def insert(self, table: str, data: pa.Table):
+        """
+        Inserts data into a table using the ArrowStream format.
+
+        Column names must match between `table` and `data`.
+
+        Args:
+            table: (str) The table into which to insert data.
+            data: (pyarrow.Table) The table of the data.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        url = create_insert_url(self._url, table, tuple(data.column_names))
+        # Serialized on a worker thread as the buffers may be compressed.
+        body = await asyncio.to_thread(
+            serialize_ipc_buffers, data, self._insert_options
+        )
+        headers = self._insert_headers | {
+            "Content-Length": str(sum(len(b) for b in body)),
+        }
+        session = self._get_session()
+        async with session.post(url, data=iter_buffers(body), headers=headers) as r:
+            await ensure_success_status(r)
+
+    async def insert_batches(
+        self,
+        table: str,
+        schema: pa.Schema,
+        batches: Iterable[pa.RecordBatch],
+    ):
+        """
+        Inserts an iterable of record batches into a table using the ArrowStream format.
+
+        Each batch is serialized and sent (using chunked transfer encoding) as it
+        is produced, so the whole of the data is never held in memory.
+
+        Column names must match between `table` and `schema`.
+
+        Args:
+            table: (str) The table into which to insert data.
+            schema: (pyarrow.Schema) The schema of the batches.
+            batches: (Iterable[pyarrow.RecordBatch]) The batches of data.
+
+        Raises:
+            ClickhouseException: When a non-success response status was received.
+        """
+        url = create_insert_url(self._url, table, tuple(schema.names))
+        body = iter_ipc_stream(schema, batches, self._insert_options)
+        session = self._get_session()
+        async with session.post(url, data=body, headers=self._insert_headers) as r:
+            await ensure_success_status(r)
+
+    @contextlib.asynccontextmanager
+    async def _open_stream(
+        self,
+        query: str,
+        params: dict[str, Any] | None,
+        settings: dict[str, Any] | None,
+    ) -> AsyncIterator[pa.RecordBatchStreamReader]:
+        async with self._execute(query, params, settings, "ArrowStream") as response:
+            source = io.BufferedReader(
+                ResponseReader(response.content, asyncio.get_running_loop()),
+                buffer_size=STREAM_BUFFER_SIZE,
+            )
+            yield await asyncio.to_thread(pa.ipc.open_stream, source)
+
+    @contextlib.asynccontextmanager
+    async def _execute(
+        self,
+        query: str,
+        params: dict[str, Any] | None,
+        settings: dict[str, Any] | None,
+        format_: str = None,
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        if format_:
+            query += f" FORMAT {format_}"
+        url, body, content_type = create_query_request(
+            self._url,
+            query,
+            params,
+            settings,
+            self._default_settings,
+            self._default_query,
+        )
+        headers = self._query_headers
+        if content_type:
+            headers = headers | {"Content-Type": content_type}
+        session = self._get_session()
+        async with session.post(
+            url,
+            data=body,
+            headers=headers,
+        ) as response:
+            await ensure_success_status(response)
+            yield response
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session is created lazily as it must be created inside a running loop.
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._limit, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+
+class ResponseReader(io.RawIOBase):
+    """
+    A blocking file-like view of a response (for use by pyarrow on a worker thread)
+    that reads from the response on the event loop.
+    """
+
+    def __init__(self, content: aiohttp.StreamReader, loop: asyncio.AbstractEventLoop):
+        self._content = content
+        self._loop = loop
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        read = self._content.read(len(buffer))
+        data = asyncio.run_coroutine_threadsafe(read, self._loop).result()
+        buffer[: len(data)] = data
+        return len(data)
+
+
+async def ensure_success_status(response: aiohttp.ClientResponse):
+    if response.status != 200:
+        raise ClickhouseException(response.status, str(await response.read()))
+
+
+async def iter_ipc_stream(
+    schema: pa.Schema,
+    batches: Iterable[pa.RecordBatch],
+    options: pa.ipc.IpcWriteOptions,
+) -> AsyncIterator[memoryview]:
+    # Each batch is serialized (and compressed) on a worker thread rather than
+    # on the event loop.
+    chunks = serialize_ipc_stream(schema, batches, options)
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        yield memoryview(chunk)
+
+
+async def iter_buffers(
+    buffers: Iterable[bytes | pa.Buffer],
+) -> AsyncIterator[memoryview]:
+    for buffer in buffers:
+        yield memoryview(buffer)
+
+
+__all__ = ["AsyncClient"]
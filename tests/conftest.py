@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pytest
+import pytest_asyncio
+import urllib3
 
 import clickhouse_arrow as ch
+import clickhouse_arrow.aio
 
 
 @pytest.fixture(scope="session")
@@ -31,17 +37,125 @@ def clickhouse(docker_ip, docker_services):
             return False
 
     docker_services.wait_until_responsive(
-        timeout=20.0,
+        # Allows for a server per pytest-xdist worker starting at the same time.
+        timeout=60.0,
         pause=1.0,
         check=lambda: is_responsive(),
     )
     return url
 
 
-@pytest.fixture
-def client(clickhouse):
-    return create_client(clickhouse)
+@pytest.fixture(scope="session")
+def numbers():
+    # The shared table is kept small as most tests only read a few rows (the
+    # insert round trip uses large_numbers).
+    return create_numbers(8192)
+
+
+@pytest.fixture(scope="session")
+def large_numbers():
+    return create_numbers(100_000)
+
+
+@pytest.fixture(scope="session")
+def pool():
+    # Shared by all clients so that connections are kept alive between tests.
+    with urllib3.PoolManager(maxsize=16, block=False) as pool:
+        yield pool
+
+
+@pytest.fixture(scope="session")
+def session_client(clickhouse, pool):
+    return create_client(clickhouse, pool=pool)
+
+
+@pytest_asyncio.fixture
+async def async_client(clickhouse, sut):
+    # Depends on sut so that the numbers table has been created.
+    async with create_async_client(clickhouse) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def sut(session_client, numbers):
+    # The numbers table is shared by all tests (so it must not be modified).
+    init_db(session_client, numbers)
+    yield session_client
 
 
 def create_client(url, **kwargs):
     return ch.Client(url, user="default", password="test", **kwargs)
+
+
+def create_async_client(url, **kwargs):
+    return clickhouse_arrow.aio.AsyncClient(
+        url, user="default", password="test", **kwargs
+    )
+
+
+def create_numbers(n):
+    ints = pa.array(np.arange(n, dtype=np.int64))
+    return pa.table({"ints": ints, "strs": pc.cast(ints, pa.string())})
+
+
+def init_db(sut, numbers, table="numbers"):
+    sut.execute(create_table_query(table))
+    sut.insert(table, numbers)
+
+
+async def init_db_async(sut, numbers, table="numbers"):
+    # The insert depends on the table, so the statements cannot be gathered.
+    await sut.execute(create_table_query(table))
+    await sut.insert(table, numbers)
+
+
+def create_table_query(table):
+    # The HTTP interface runs a single statement per request, so the table is
+    # replaced (rather than dropped and created) to save a round trip.
+    return f"""
+        create or replace table {table} (
+            ints Int64 NULL,
+            strs String NULL
+        )
+        engine = Memory
+        """
+
+
+def assert_table(actual, expected):
+    # Compares the types and then the Arrow data (rather than converting the actual
+    # table to Python objects). The expected columns must be built with explicit
+    # types as pyarrow would otherwise infer them.
+    expected = pa.table(expected)
+    schema = pa.schema(
+        [(f.name, nullable_type(f.type)) for f in actual.schema],
+    )
+    assert schema == expected.schema, f"{actual.schema} != {expected.schema}"
+    actual = actual.cast(schema)
+    assert actual.equals(expected), f"{actual.to_pydict()} != {expected.to_pydict()}"
+
+
+def nullable_type(type_):
+    # ClickHouse marks the fields of columns (and nested types) that are not
+    # Nullable as not null, which isn't what the tests are checking.
+    if pa.types.is_map(type_):
+        return pa.map_(nullable_type(type_.key_type), nullable_type(type_.item_type))
+    if pa.types.is_list(type_):
+        return pa.list_(nullable_type(type_.value_type))
+    if pa.types.is_struct(type_):
+        return pa.struct([(f.name, nullable_type(f.type)) for f in type_])
+    return type_
+
+
+# The first rows of the numbers table (as read without any settings).
+NUMBERS_HEAD = pa.table(
+    {"ints": [0, 1, 2], "strs": [b"0", b"1", b"2"]},
+    schema=pa.schema([("ints", pa.int64()), ("strs", pa.binary())]),
+)
+
+# The row of the numbers table where ints is 10.
+NUMBERS_TEN = pa.table(
+    {
+        "ints": pa.array([10], type=pa.int64()),
+        "strs": pa.array([b"10"], type=pa.binary()),
+    }
+)
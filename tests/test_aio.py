@@ -0,0 +1,95 @@
+# Copyright 2023 Martin Galpin <galpin@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import orjson
+import pyarrow as pa
+import pytest
+
+from clickhouse_arrow import ClickhouseException
+from .conftest import (
+    NUMBERS_HEAD,
+    NUMBERS_TEN,
+    assert_table,
+    init_db_async,
+)
+
+
+@pytest.mark.asyncio
+async def test_insert_table(async_client, numbers):
+    await init_db_async(async_client, numbers, "async_numbers")
+    await async_client.insert("async_numbers", numbers)
+    actual = await async_client.read_table("select count() as n from async_numbers")
+    assert_table(actual, {"n": pa.array([2 * len(numbers)], pa.uint64())})
+
+
+@pytest.mark.asyncio
+async def test_insert_batches(async_client, numbers):
+    await init_db_async(async_client, numbers, "async_batched_numbers")
+    batches = numbers.to_batches(max_chunksize=1_000)
+    await async_client.insert_batches("async_batched_numbers", numbers.schema, batches)
+    actual = await async_client.read_table(
+        "select count() as n from async_batched_numbers"
+    )
+    assert_table(actual, {"n": pa.array([2 * len(numbers)], pa.uint64())})
+
+
+@pytest.mark.asyncio
+async def test_read_table(async_client):
+    actual = await async_client.read_table("select * from numbers limit 3")
+    assert actual.equals(NUMBERS_HEAD)
+
+
+@pytest.mark.asyncio
+async def test_read_table_with_parameters(async_client):
+    actual = await async_client.read_table(
+        "select * from numbers where ints = {i:Int64}",
+        params={"i": 10},
+    )
+    assert actual.equals(NUMBERS_TEN)
+
+
+@pytest.mark.asyncio
+async def test_read_batches(async_client, numbers):
+    reader = async_client.read_batches("select * from numbers")
+    actual = [b async for b in reader]
+    assert pa.Table.from_batches(actual).num_rows == len(numbers)
+
+
+@pytest.mark.asyncio
+async def test_read_table_concurrently(async_client):
+    actual = await asyncio.gather(
+        *(
+            async_client.read_table("select {i:Int64} as actual", params={"i": i})
+            for i in range(10)
+        )
+    )
+    assert [t["actual"][0].as_py() for t in actual] == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_execute(async_client):
+    actual = await async_client.execute(
+        "select strs from numbers limit 1 format JSONEachRow"
+    )
+    assert orjson.loads(actual) == {"strs": "0"}
+
+
+@pytest.mark.asyncio
+async def test_execute_raises_when_non_success_status(async_client):
+    expected = r"Unexpected HTTP response status code: 400\."
+    with pytest.raises(ClickhouseException, match=expected) as actual:
+        await async_client.read_table("syntax error")
+    assert actual.value.body is not None
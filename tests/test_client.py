@@ -12,45 +12,94 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
-
+import orjson
 import pyarrow as pa
 import pytest
 
-from clickhouse_arrow import ClickhouseException
-from .conftest import create_client
+from clickhouse_arrow import (
+    MAX_CACHED_PARAM_LENGTH,
+    ClickhouseException,
+    bind_cached,
+    bind_param,
+)
+from .conftest import (
+    NUMBERS_HEAD,
+    NUMBERS_TEN,
+    assert_table,
+    create_client,
+    init_db,
+)
 
 
-def test_insert_table(sut):
+@pytest.mark.parametrize("compression", ["lz4", "zstd"])
+def test_insert_table(clickhouse, pool, large_numbers, compression):
+    # The large insert is compressed (as it is otherwise bound by the network).
+    sut = create_client(clickhouse, pool=pool, insert_compression=compression)
+    init_db(sut, large_numbers, "large_numbers")
     actual = sut.read_table(
-        "select * from numbers",
+        "select * from large_numbers",
         settings={"output_format_arrow_string_as_string": 1},
     )
-    assert actual.equals(NUMBERS)
+    assert actual.equals(large_numbers)
+
+
+def test_prepare_insert(sut, numbers):
+    init_db(sut, numbers, "prepared_numbers")
+    insert = sut.prepare_insert("prepared_numbers", numbers.schema)
+    insert(numbers)
+    actual = sut.read_table("select count() as n from prepared_numbers")
+    assert_table(actual, {"n": pa.array([2 * len(numbers)], pa.uint64())})
+
+
+def test_insert_batches(sut, numbers):
+    init_db(sut, numbers, "batched_numbers")
+    batches = (b for b in numbers.to_batches(max_chunksize=1_000))
+    sut.insert_batches("batched_numbers", numbers.schema, batches)
+    actual = sut.read_table("select count() as n from batched_numbers")
+    assert_table(actual, {"n": pa.array([2 * len(numbers)], pa.uint64())})
 
 
 def test_read_table(sut):
-    expected = pa.Table.from_pydict(
-        {
-            "ints": [0, 1, 2],
-            "strs": [b"0", b"1", b"2"],
-        }
-    )
     actual = sut.read_table("select * from numbers limit 3")
-    assert actual.equals(expected)
-    assert actual.schema == pa.schema(
-        [
-            pa.field("ints", pa.int64()),
-            pa.field("strs", pa.binary()),
-        ]
+    assert actual.equals(NUMBERS_HEAD)
+    assert actual.schema == NUMBERS_HEAD.schema
+
+
+def test_read_table_with_no_rows(sut):
+    actual = sut.read_table("select * from numbers where 0")
+    assert actual.num_rows == 0
+    assert actual.schema == NUMBERS_HEAD.schema
+
+
+def test_open_stream(sut):
+    with sut.open_stream("select * from numbers limit 3") as reader:
+        assert reader.schema == NUMBERS_HEAD.schema
+        actual = pa.Table.from_batches(list(reader), reader.schema)
+    assert actual.equals(NUMBERS_HEAD)
+
+
+def test_read_batches(sut, numbers):
+    actual = sut.read_batches(
+        "select * from numbers",
+        settings={"output_format_arrow_string_as_string": 1},
     )
+    assert pa.Table.from_batches(actual).equals(numbers)
+
+
+def test_read_table_with_combine(sut, numbers):
+    actual = sut.read_table(
+        "select * from numbers",
+        settings={"output_format_arrow_string_as_string": 1},
+        combine=True,
+    )
+    assert actual.equals(numbers)
+    assert all(c.num_chunks == 1 for c in actual.columns)
 
 
 def test_read_table_with_parameters(sut):
-    expected = pa.Table.from_pydict({"ints": [10]})
     actual = sut.read_table(
         """
-        select ints from numbers
+        select * from numbers
         where ints = {i:Int64} and strs = {s:String}
         limit 1
         """,
@@ -59,187 +108,181 @@ def test_read_table_with_parameters(sut):
             "s": "10",
         },
     )
-    assert actual == expected
+    assert actual.equals(NUMBERS_TEN)
+
+
+def test_read_ipc_stream(sut):
+    data = b"".join(sut.read_ipc_stream("select * from numbers limit 3"))
+    actual = pa.ipc.open_stream(data).read_all()
+    assert actual.equals(NUMBERS_HEAD)
 
 
 def test_execute_raises_when_non_success_status(sut):
-    with pytest.raises(ClickhouseException) as actual:
+    expected = r"Unexpected HTTP response status code: 400\."
+    with pytest.raises(ClickhouseException, match=expected) as actual:
         sut.read_table("syntax error")
-    exception = actual.value
-    assert "Unexpected HTTP response status code: 400." in str(exception)
-    assert exception.body is not None
+    assert actual.value.body is not None
 
 
 def test_execute(sut):
     actual = sut.execute("select strs from numbers limit 1 format JSONEachRow")
-    assert json.loads(actual) == {"strs": "0"}
+    assert orjson.loads(actual) == {"strs": "0"}
 
 
-def test_execute_with_parameters(sut):
-    actual = sut.read_table(
-        """
-        select * from numbers
-        where ints = {i:Int64} AND strs = {s:String}
-        limit 1
-        """,
-        params={
-            "i": 10,
-            "s": "10",
-        },
-    )
-    assert_table(actual, {"ints": [10], "strs": [b"10"]})
+def test_read_table_with_settings(sut):
+    actual = sut.read_table("select ints from numbers", settings={"limit": 1})
+    assert_table(actual, {"ints": pa.array([0], pa.int64())})
 
 
-def test_execute_with_settings(sut):
-    actual = sut.execute(
-        "select ints from numbers format JSONEachRow",
-        settings={"limit": 1},
-    )
-    assert json.loads(actual) == {"ints": "0"}
+@pytest.mark.usefixtures("sut")
+def test_read_table_with_default_settings(clickhouse, pool):
+    sut = create_client(clickhouse, pool=pool, default_settings={"limit": 1})
+    actual = sut.read_table("select ints from numbers")
+    assert_table(actual, {"ints": pa.array([0], pa.int64())})
 
 
-def test_execute_with_default_settings(clickhouse):
-    sut = create_client(clickhouse, default_settings={"limit": 1})
-    actual = sut.execute("select ints from numbers format JSONEachRow")
-    assert json.loads(actual) == {"ints": "0"}
+@pytest.mark.usefixtures("sut")
+def test_read_table_with_default_and_query_settings(clickhouse, pool):
+    sut = create_client(clickhouse, pool=pool, default_settings={"limit": 42})
+    actual = sut.read_table("select ints from numbers", settings={"limit": 1})
+    assert_table(actual, {"ints": pa.array([0], pa.int64())})
 
 
-def test_execute_with_default_and_query_settings(clickhouse):
-    sut = create_client(clickhouse, default_settings={"limit": 42})
-    actual = sut.execute(
-        "select ints from numbers format JSONEachRow",
-        settings={"limit": 1},
-    )
-    assert json.loads(actual) == {"ints": "0"}
-
-
-def test_execute_with_int_parameter(sut):
+@pytest.mark.usefixtures("sut")
+def test_read_table_with_http_compression(clickhouse, pool, numbers):
+    sut = create_client(clickhouse, pool=pool, http_compression=True)
     actual = sut.read_table(
-        "select {expected:Int64} as actual",
-        params={"expected": 10},
+        "select * from numbers",
+        settings={"output_format_arrow_string_as_string": 1},
     )
-    assert_table(actual, {"actual": [10]})
+    assert actual.equals(numbers)
 
 
-def test_execute_with_str_parameter(sut):
-    actual = sut.read_table(
-        "select {expected:String} as actual",
-        params={"expected": "10"},
-    )
-    assert_table(actual, {"actual": [b"10"]})
+@pytest.mark.usefixtures("sut")
+def test_read_ipc_stream_with_http_compression(clickhouse, pool):
+    sut = create_client(clickhouse, pool=pool, http_compression=True)
+    data = b"".join(sut.read_ipc_stream("select * from numbers limit 3"))
+    actual = pa.ipc.open_stream(data).read_all()
+    assert actual.equals(NUMBERS_HEAD)
 
 
-@pytest.mark.parametrize(
-    "param_type, param, expected",
-    [
-        [
-            "Array(Int64)",
-            [1, 2, 3],
-            {"actual": [[1, 2, 3]]},
-        ],
+def test_execute_with_scalar_parameters(sut):
+    assert_parameters(
+        sut,
         [
-            "Array(String)",
-            ["1", "2", "3"],
-            {"actual": [[b"1", b"2", b"3"]]},
+            ["Int64", 10, 10, pa.int64()],
+            ["String", "10", b"10", pa.binary()],
+            ["Nullable(String)", None, b"NULL", pa.binary()],
         ],
-    ],
-)
-def test_execute_with_array_parameter(sut, param_type, param, expected):
-    actual = sut.read_table(
-        f"select {{expected:{param_type}}} as actual",
-        params={"expected": param},
     )
-    assert_table(actual, expected)
 
 
-def test_execute_with_tuple_parameter(sut):
-    actual = sut.read_table(
-        "select {expected:Tuple(Int64, Int64, Int64)} as actual",
-        params={"expected": (1, 2, 3)},
+def test_execute_with_array_parameters(sut):
+    assert_parameters(
+        sut,
+        [
+            ["Array(Int64)", [1, 2, 3], [1, 2, 3], pa.list_(pa.int64())],
+            ["Array(String)", ["1", "2", "3"], [b"1", b"2", b"3"], BINARY_LIST],
+            ["Array(String)", ["a'b", "c\\d"], [b"a'b", b"c\\d"], BINARY_LIST],
+        ],
     )
-    assert_table(actual, {"actual": [{"1": 1, "2": 2, "3": 3}]})
 
 
-def test_execute_with_null_parameter(sut):
+def test_execute_with_large_parameter(sut):
+    expected = list(range(10_000))
     actual = sut.read_table(
-        "select {expected:Nullable(String)} as actual",
-        params={"expected": None},
+        "select {expected:Array(Int64)} as actual",
+        params={"expected": expected},
     )
-    assert_table(actual, {"actual": [b"NULL"]})
+    assert_table(actual, {"actual": pa.array([expected], pa.list_(pa.int64()))})
 
 
-@pytest.mark.parametrize(
-    "expected",
-    [True, False],
-)
-def test_execute_with_bool_parameter(sut, expected):
+def test_execute_with_tuple_parameter(sut):
     actual = sut.read_table(
-        "select {expected:Bool} as actual",
-        params={"expected": expected},
+        "select {expected:Tuple(Int64, Int64, Int64)} as actual",
+        params={"expected": (1, 2, 3)},
     )
-    assert_table(actual, {"actual": [expected]})
+    expected_type = pa.struct([("1", pa.int64()), ("2", pa.int64()), ("3", pa.int64())])
+    expected = pa.array([{"1": 1, "2": 2, "3": 3}], expected_type)
+    assert_table(actual, {"actual": expected})
 
 
-@pytest.mark.parametrize(
-    "param_type, param, expected",
-    [
-        [
-            "Map(String, Int64)",
-            {"a": 1, "b": 2},
-            {"actual": [[(b"a", 1), (b"b", 2)]]},
-        ],
-        [
-            "Map(Int64, String)",
-            {1: "a", 2: "b"},
-            {"actual": [[(1, b"a"), (2, b"b")]]},
-        ],
+def test_execute_with_bool_parameters(sut):
+    assert_parameters(
+        sut,
         [
-            "Map(Int64, Array(Int64))",
-            {1: [1, 2, 3]},
-            {"actual": [[(1, [1, 2, 3])]]},
+            ["Bool", True, True, pa.bool_()],
+            ["Bool", False, False, pa.bool_()],
         ],
+    )
+
+
+def test_execute_with_map_parameters(sut):
+    assert_parameters(
+        sut,
         [
-            "Map(Int64, Map(String, String))",
-            {1: {"a": "b"}},
-            {"actual": [[(1, [(b"a", b"b")])]]},
+            [
+                "Map(String, Int64)",
+                {"a": 1, "b": 2},
+                [(b"a", 1), (b"b", 2)],
+                pa.map_(pa.binary(), pa.int64()),
+            ],
+            [
+                "Map(Int64, String)",
+                {1: "a", 2: "b"},
+                [(1, b"a"), (2, b"b")],
+                pa.map_(pa.int64(), pa.binary()),
+            ],
+            [
+                "Map(String, String)",
+                {"a'b": "c\\d"},
+                [(b"a'b", b"c\\d")],
+                BINARY_MAP,
+            ],
+            [
+                "Map(Int64, Array(Int64))",
+                {1: [1, 2, 3]},
+                [(1, [1, 2, 3])],
+                pa.map_(pa.int64(), pa.list_(pa.int64())),
+            ],
+            [
+                "Map(Int64, Map(String, String))",
+                {1: {"a": "b"}},
+                [(1, [(b"a", b"b")])],
+                pa.map_(pa.int64(), BINARY_MAP),
+            ],
         ],
-    ],
-)
-def test_execute_with_map_parameter(sut, param_type, param, expected):
-    actual = sut.read_table(
-        f"select {{expected:{param_type}}} as actual",
-        params={"expected": param},
     )
-    assert_table(actual, expected)
 
 
-def assert_table(actual, expected):
-    assert actual.to_pydict() == expected
+def test_bind_param_distinguishes_negative_zero():
+    # 0.0 == -0.0 (with the same hash), so floats must not share a cached binding.
+    assert bind_param([0.0]) == "[0.0]"
+    assert bind_param([-0.0]) == "[-0.0]"
+    assert bind_param((0.0,)) == "(0.0)"
+    assert bind_param((-0.0,)) == "(-0.0)"
 
 
-@pytest.fixture
-def sut(client):
-    init_db(client)
-    yield client
+def test_bind_param_does_not_cache_large_lists():
+    bind_cached.cache_clear()
+    bind_param(list(range(MAX_CACHED_PARAM_LENGTH + 1)))
+    assert bind_cached.cache_info().currsize == 0
+    bind_param(list(range(MAX_CACHED_PARAM_LENGTH)))
+    assert bind_cached.cache_info().currsize == 1
 
 
-def init_db(sut):
-    sut.execute("drop table if exists numbers")
-    sut.execute(
-        """
-        create table numbers (
-            ints Int64 NULL,
-            strs String NULL
-        )
-        engine = Memory
-        """,
+def assert_parameters(sut, cases):
+    # Selects each case of [type, param, expected, Arrow type] as a column of a
+    # single query.
+    columns = ", ".join(f"{{p{i}:{c[0]}}} as p{i}" for i, c in enumerate(cases))
+    actual = sut.read_table(
+        f"select {columns}",
+        params={f"p{i}": param for i, (_, param, _, _) in enumerate(cases)},
     )
-    sut.insert("numbers", NUMBERS)
+    expected = {f"p{i}": pa.array([e], t) for i, (_, _, e, t) in enumerate(cases)}
+    assert_table(actual, expected)
 
 
-NUMBERS = pa.Table.from_pydict(
-    {
-        "ints": list(range(100_000)),
-        "strs": [str(x) for x in range(100_000)],
-    }
-)
+# The Arrow types of strings in containers (as read without any settings).
+BINARY_LIST = pa.list_(pa.binary())
+BINARY_MAP = pa.map_(pa.binary(), pa.binary())